@@ -0,0 +1,107 @@
+import functools
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Up to this many rotated points (points x repeat), plain floats beat the numpy
+# version. The compiled numba kernel is quicker even for a single point.
+SCALAR_THRESHOLD = 8 if numba is None else 0
+
+
+@functools.lru_cache(maxsize=32)
+def _rotation_tables(repeat):
+    """The cosine and sine of each of ``repeat`` evenly spaced angles over a full
+    revolution. Cached as the same ``repeat`` is usually patterned many times."""
+
+    angles = np.arange(repeat) * ((2 * np.pi) / repeat)
+    cos, sin = np.cos(angles), np.sin(angles)
+    # The arrays are shared between callers so make sure they can't be changed.
+    cos.flags.writeable = False
+    sin.flags.writeable = False
+    return cos, sin
+
+
+@functools.lru_cache(maxsize=32)
+def _scalar_rotation_tables(repeat):
+    """``_rotation_tables`` as (cos, sin) pairs of plain floats."""
+
+    return tuple(zip(*(table.tolist() for table in _rotation_tables(repeat))))
+
+
+def _rotate_points_numpy(points, center, cos, sin):
+    """Rotate ``points`` about ``center`` by every angle in the ``cos``/``sin``
+    tables in one go. Returns an array of shape (repeat, n, 2)."""
+
+    # Build every rotation matrix up front, shape (repeat, 2, 2).
+    repeat = cos.shape[0]
+    rotation_matrices = np.empty((repeat, 2, 2))
+    rotation_matrices[:, 0, 0] = cos
+    rotation_matrices[:, 0, 1] = -sin
+    rotation_matrices[:, 1, 0] = sin
+    rotation_matrices[:, 1, 1] = cos
+    return np.einsum('rij,nj->rni', rotation_matrices, points - center) + center
+
+
+def _rotate_points_loops(points, center, cos, sin):
+    """Same as ``_rotate_points_numpy`` but written as plain loops for numba to compile."""
+
+    rotated_points = np.empty((cos.shape[0], points.shape[0], 2))
+    for r in range(cos.shape[0]):
+        for n in range(points.shape[0]):
+            x = points[n, 0] - center[0]
+            y = points[n, 1] - center[1]
+            rotated_points[r, n, 0] = (cos[r] * x - sin[r] * y) + center[0]
+            rotated_points[r, n, 1] = (sin[r] * x + cos[r] * y) + center[1]
+    return rotated_points
+
+
+def _rotate_points_scalar(points, center, repeat):
+    """Same as ``rotate_points`` but using plain floats, for small numbers of points.
+    Returns a list of frames, each a list of [x, y] points."""
+
+    cx, cy = center
+    rotated_points = []
+    for cos, sin in _scalar_rotation_tables(repeat):
+        rotated_points.append([[round(cos * (x - cx) - sin * (y - cy) + cx, 5),
+                                round(sin * (x - cx) + cos * (y - cy) + cy, 5)] for x, y in points])
+    return rotated_points
+
+
+# numba is optional, without it the vectorised numpy version is used.
+_rotate_points = _rotate_points_numpy if numba is None else numba.njit(cache=True)(_rotate_points_loops)
+
+
+def _as_points(points):
+    """Convert ``points`` to an (n, 2) float64 array, checking its shape."""
+
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError('Points must be of the form [[x1, y1], [x2, y2], ...].')
+    return points
+
+
+def rotate_points(points, center, repeat):
+    """Rotate ``points`` about ``center`` by each of ``repeat`` evenly spaced angles
+    over a full revolution, the first being no rotation. The results are rounded to
+    5 decimal places and returned as an array of shape (repeat, n, 2). ``points`` can be
+    a list of lists or an (n, 2) array, a contiguous float64 array is used without copying."""
+
+    points = _as_points(points)
+    center = np.asarray(center, dtype=np.float64)
+    cos, sin = _rotation_tables(repeat)
+    return np.round(_rotate_points(points, center, cos, sin), decimals=5)
+
+
+def rotate_points_list(points, center, repeat):
+    """The same as ``rotate_points`` but returns a list of frames, each a list of
+    [x, y] points, ready to be passed to the drawing commands."""
+
+    # Checked up front so both paths reject malformed points the same way.
+    array = _as_points(points)
+    if repeat * len(array) <= SCALAR_THRESHOLD:
+        return _rotate_points_scalar(array.tolist(), center, repeat)
+    return rotate_points(array, center, repeat).tolist()
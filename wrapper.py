@@ -1,7 +1,14 @@
+import ast
 import os
+import re
+from contextlib import contextmanager
+
+import pywintypes
 import win32com.client
 import numpy as np
 
+from geometry import rotate_points_list
+
 DOCTYPE_MAPPING = {
     'magnetics': 1,
     'electrostatics': 2,
@@ -27,14 +34,49 @@ PREFIX_DOCTYPE_MAPPING = {
     'c': 'current',
 }
 
+# Any run of forward or back slashes in a path.
+PATH_SEPARATOR_PATTERN = re.compile(r'[\\/]+')
+
+# Argument types that can be passed straight to ``str``. Exact types are used
+# (rather than ``isinstance``) so that ``bool`` isn't treated as a number.
+NUMERIC_TYPES = frozenset((int, float, np.int32, np.int64, np.float32, np.float64))
+
+# Commands whose return value is never used, these can safely be
+# queued up and sent to FEMM together inside ``FEMMSession.batch``.
+BATCHABLE_COMMANDS = {
+    'addnode',
+    'addsegment',
+    'addarc',
+    'addblocklabel',
+    'selectnode',
+    'selectsegment',
+    'selectarcsegment',
+    'selectlabel',
+    'clearselected',
+    'setgroup',
+    'setsegmentprop',
+    'setblockprop',
+}
+
 
 class FEMMSession:
     """A simple wrapper around FEMM 4.2."""
 
     doctype_prefix = None
+    # Parse results with ``eval`` rather than ``ast.literal_eval``, only needed
+    # for commands that return something other than literals.
+    use_eval = False
 
     def __init__(self):
-        self.__to_femm = win32com.client.Dispatch('femm.ActiveFEMM')
+        try:
+            # Early binding avoids looking up ``mlab2femm`` on every call.
+            self.__to_femm = win32com.client.gencache.EnsureDispatch('femm.ActiveFEMM')
+        except (AttributeError, TypeError, pywintypes.com_error):
+            # The gencache can be stale on the first run, or FEMM's type library
+            # may be missing or fail to load, so fall back to late binding.
+            self.__to_femm = win32com.client.Dispatch('femm.ActiveFEMM')
+        self._mlab2femm = self.__to_femm.mlab2femm
+        self._buffer = None
         self.set_current_directory()
         self.pre = PreprocessorAPI(self)
         self.post = PostProcessorAPI(self)
@@ -42,31 +84,113 @@ class FEMMSession:
     def _add_doctype_prefix(self, string):
         return self.doctype_prefix + string
 
+    @staticmethod
+    def _is_batchable(string):
+        """Check whether a command string can be deferred until the end of a batch."""
+
+        command_name = string.partition('(')[0].partition('_')[2]
+        return command_name in BATCHABLE_COMMANDS
+
+    def _flush(self):
+        """Send all buffered commands to FEMM as a single script."""
+
+        if not self._buffer:
+            return
+        script = '\n'.join(self._buffer)
+        self._buffer.clear()
+        res = self._mlab2femm(script)
+        if len(res) != 0 and res[0] == 'e':
+            # There's no telling which of the batched nodes were actually
+            # added, so stop the preprocessor from skipping any of them.
+            self.pre.clear_nodes()
+            raise Exception(res)
+
+    @contextmanager
+    def batch(self):
+        """Buffer any commands that don't return a value and send them to FEMM in one
+        ``mlab2femm`` call when the block exits. Commands that do return a value flush
+        the buffer first so the order of execution is preserved. e.g.:
+
+            with session.batch():
+                session.pre.draw_polyline(points=[[0, 0], [1, 0], [1, 1]])"""
+
+        if self._buffer is not None:
+            # Already inside a batch, the outermost one will flush.
+            yield
+            return
+        self._buffer = []
+        try:
+            try:
+                yield
+            except BaseException:
+                # Still send what was queued before the error, as would have
+                # happened without a batch, but don't let a failing flush hide
+                # the error raised inside the block.
+                try:
+                    self._flush()
+                except Exception:
+                    pass
+                raise
+            self._flush()
+        finally:
+            self._buffer = None
+
     def call_femm(self, string, add_doctype_prefix=False):
         """Call a given command string using ``mlab2femm``."""
 
         if add_doctype_prefix:
-            res = self.__to_femm.mlab2femm(self._add_doctype_prefix(string))
-        else:
-            res = self.__to_femm.mlab2femm(string)
+            string = self._add_doctype_prefix(string)
+        if self._buffer is not None:
+            if self._is_batchable(string):
+                self._buffer.append(string)
+                return None
+            self._flush()
+        res = self._mlab2femm(string)
         if len(res) == 0:
             res = []
         elif res[0] == 'e':
             raise Exception(res)
         else:
-            try:
-                res = eval(res)
-            except SyntaxError:
-                # TODO: Look into this.
-                pass
+            res = self._parse_result(res)
         if len(res) == 1:
             res = res[0]
         return res
 
+    def _parse_result(self, res):
+        """Convert the string returned by FEMM into Python values."""
+
+        try:
+            # Most commands return a list of numbers so try the cheap route first.
+            return [float(value) for value in res.strip('[] \n').replace(',', ' ').split()]
+        except ValueError:
+            pass
+        try:
+            return eval(res) if self.use_eval else ast.literal_eval(res)
+        except (SyntaxError, ValueError):
+            # TODO: Look into this.
+            return res
+
+    def call_femm_void(self, string):
+        """Call a given command string using ``mlab2femm`` for a command that doesn't
+        return anything, skipping all handling of the result other than checking for
+        an error. Inside a batch the command is always buffered."""
+
+        if self._buffer is not None:
+            self._buffer.append(string)
+            return
+        res = self._mlab2femm(string)
+        if res and res[0] == 'e':
+            raise Exception(res)
+
     def call_femm_noeval(self, string):
         """Call a given command string using ``mlab2femm`` without eval."""
 
-        self.__to_femm(string)
+        if self._buffer is not None:
+            if self._is_batchable(string):
+                self._buffer.append(string)
+                return
+            self._flush()
+        self._mlab2femm(string)
 
     def call_femm_with_args(self, command, *args, add_doctype_prefix=True, **kwargs):
         """Call a given command string using ``mlab2femm`` and parse the args."""
@@ -77,9 +201,9 @@ class FEMMSession:
 
     @staticmethod
     def _fix_path(path):
-        """Replace \\ and // with a single forward slash."""
+        """Replace any run of \\ and / with a single forward slash."""
 
-        return path.replace('\\', '/').replace('//', '/')
+        return PATH_SEPARATOR_PATTERN.sub('/', path)
 
     def _parse_args(self, args):
         """Convert each argument into a string and then join them by commas."""
@@ -115,6 +239,7 @@ class FEMMSession:
         mode = DOCTYPE_MAPPING[doctype] if isinstance(doctype, str) else doctype
         self.call_femm(f'newdocument({mode})')
         self.set_mode(mode)
+        self.pre.clear_nodes()
 
     def quit(self):
         """Close all documents and exit the the Interactive Shell at the end of
@@ -135,15 +260,37 @@ class BaseAPI:
 
     def __init__(self, session):
         self.session = session
+        # The same argument-less commands are called over and over, so their
+        # full call strings are only built the first time each one is used.
+        self._command_cache = {}
+        # Bound once here to save the attribute lookups on every call.
+        self._call = session.call_femm
+        self._call_void = session.call_femm_void
+        self._prefixed_call = session.call_femm_with_args
 
     def _add_mode_prefix(self, string):
         return f'{self.mode_prefix}_{string}'
 
-    def _call_femm(self, string, **kwargs):
-        return self.session.call_femm(f'{self._add_mode_prefix(string)}()', **kwargs)
+    def _command(self, string, add_doctype_prefix=False):
+        """The full call string for a command that takes no arguments."""
+
+        key = (string, add_doctype_prefix, self.session.doctype_prefix)
+        command = self._command_cache.get(key)
+        if command is None:
+            command = f'{self._add_mode_prefix(string)}()'
+            if add_doctype_prefix:
+                command = self.session.doctype_prefix + command
+            self._command_cache[key] = command
+        return command
+
+    def _call_femm(self, string, add_doctype_prefix=False, **kwargs):
+        return self._call(self._command(string, add_doctype_prefix), **kwargs)
+
+    def _call_femm_void(self, string, add_doctype_prefix=False):
+        self._call_void(self._command(string, add_doctype_prefix))
 
     def _call_femm_with_args(self, string, *args, **kwargs):
-        return self.session.call_femm_with_args(self._add_mode_prefix(string), *args, **kwargs)
+        return self._prefixed_call(self._add_mode_prefix(string), *args, **kwargs)
 
 
 class PreprocessorAPI(BaseAPI):
@@ -151,20 +298,36 @@ class PreprocessorAPI(BaseAPI):
 
     mode_prefix = 'i'
 
+    def __init__(self, session):
+        super().__init__(session)
+        # Exact (x, y) of every node added to the current document, so that
+        # drawing helpers sharing a node only send it to FEMM once. Pattern
+        # points are already rounded by ``geometry``, so their shared corners
+        # match exactly; rounding here would merge genuinely distinct nodes.
+        self._nodes = set()
+
+    def clear_nodes(self):
+        """Forget which nodes have been added, e.g. after they have been deleted
+        by a command that ``python-femm`` doesn't keep track of."""
+
+        self._nodes.clear()
+
     def close(self):
         """Closes current magnetics preprocessor document and
         destroys magnetics preprocessor window."""
 
         self._call_femm('close', add_doctype_prefix=True)
+        self.clear_nodes()
 
     # Utilities
 
     @staticmethod
     def draw_pattern(commands=None, center=None, repeat=None):
-        change_in_angle = (2 * np.pi) / repeat
         ret = []
         for command, kwargs in commands:
             command_ret = [kwargs['points']]
+            # Rotate all points about ``center`` for every repeat at once, shape (repeat, n, 2).
+            rotated_points = rotate_points_list(kwargs['points'], center, repeat)
             for i in range(repeat):
                 if i == 0:
                     try:
@@ -172,18 +335,7 @@ class PreprocessorAPI(BaseAPI):
                     except TypeError:
                         command(**kwargs)
                 else:
-                    points = kwargs['points']
-                    pattern_angle = change_in_angle * i
-                    rotation_matrix = np.array([[np.cos(pattern_angle), -np.sin(pattern_angle)],
-                                                [np.sin(pattern_angle), np.cos(pattern_angle)]])
-                    # Transform all points to center rotation about the origin.
-                    new_points = [point - np.array(center) for point in points]
-                    # Rotate all points by ``pattern_angle``.
-                    new_points = [np.dot(rotation_matrix, np.array(point).reshape(2, 1)).reshape(2) for point in
-                                  new_points]
-                    # Transform all points back to their original center.
-                    new_points = [point + np.array(center) for point in new_points]
-                    new_points = [np.round(point, decimals=5).tolist() for point in new_points]
+                    new_points = rotated_points[i]
                     command_ret.append(new_points)
                     try:
                         command(points=new_points, i=i,
@@ -200,7 +352,12 @@ class PreprocessorAPI(BaseAPI):
         """Add a new node at x, y."""
 
         x, y = points[0]
-        self._call_femm_with_args('addnode', x, y)
+        key = (x, y)
+        if key not in self._nodes:
+            # Formatted inline rather than through ``_call_femm_with_args`` as this is called constantly.
+            self._call_void(f'{self.session.doctype_prefix}i_addnode({x}, {y})')
+            # Only remember the node once FEMM has accepted it (or it has been batched).
+            self._nodes.add(key)
         if group is not None:
             self.select_node(points=points)
             self.set_group(group)
@@ -211,7 +368,7 @@ class PreprocessorAPI(BaseAPI):
 
         x1, y1 = points[0]
         x2, y2 = points[1]
-        self._call_femm_with_args('addsegment', x1, y1, x2, y2)
+        self._call_void(f'{self.session.doctype_prefix}i_addsegment({x1}, {y1}, {x2}, {y2})')
         if group is not None:
             self.select_segment(points=points)
             self.set_segment_prop(group=group)
@@ -221,7 +378,7 @@ class PreprocessorAPI(BaseAPI):
         """Add a new block label at (x, y)."""
 
         x, y = points[0]
-        self._call_femm_with_args('addblocklabel', x, y)
+        self._call_void(f'{self.session.doctype_prefix}i_addblocklabel({x}, {y})')
         if block_name is not None:
             self.select_label(points=points)
             self.set_block_prop(block_name=block_name, in_circuit=in_circuit.format(i=i + 1), **kwargs)
@@ -231,7 +388,12 @@ class PreprocessorAPI(BaseAPI):
         """Add a new arc segment from the nearest node to (x1, y1) to the nearest node to
         (x2, y2) with angle ‘angle’ divided into ‘max_seg’ segments."""
 
-        self._call_femm_with_args('addarc', *points[0], *points[1], angle, max_seg)
+        (x1, y1), (x2, y2) = points
+        if type(angle) in NUMERIC_TYPES and type(max_seg) in NUMERIC_TYPES:
+            self._call_void(f'{self.session.doctype_prefix}i_addarc({x1}, {y1}, {x2}, {y2}, {angle}, {max_seg})')
+        else:
+            # Let ``_parse_args`` deal with ``None``, bools etc.
+            self._call_femm_with_args('addarc', x1, y1, x2, y2, angle, max_seg)
         if group is not None:
             self.select_arc_segment(points=points)
             self.set_group(group)
@@ -246,15 +408,15 @@ class PreprocessorAPI(BaseAPI):
 
     def draw_polyline(self, points=None, group=None):
         """Adds nodes at each of the specified points and connects them with segments.
-        ``points`` will look something like [[x1, y1], [x2, y2], ...]"""
+        ``points`` will look something like [[x1, y1], [x2, y2], ...], an (n, 2) array
+        such as a frame from ``geometry.rotate_points`` can also be passed directly."""
 
-        for i, current_point in enumerate(points):
-            # Add each node.
-            self.add_node(points=[current_point], group=group)
-            if 0 < i < len(points):
-                # Draw lines between each node.
-                previous_point = points[i - 1]
-                self.draw_line(points=[previous_point, current_point], group=group)
+        # Add each node once.
+        for point in points:
+            self.add_node(points=[point], group=group)
+        # Draw lines between each node.
+        for previous_point, current_point in zip(points, points[1:]):
+            self.add_segment(points=[previous_point, current_point], group=group)
 
     def draw_polygon(self, points=None, group=None):
         """Adds nodes at each of the specified points and connects them with
@@ -262,7 +424,7 @@ class PreprocessorAPI(BaseAPI):
 
         self.draw_polyline(points=points, group=group)
         # Connect the first and the last nodes.
-        self.draw_line(points=[points[0], points[::-1][0]], group=group)
+        self.add_segment(points=[points[0], points[-1]], group=group)
 
     def draw_arc(self, points=None, angle=None, max_seg=None, group=None):
         """Adds nodes at (x1,y1) and (x2,y2) and adds an arc of the specified
@@ -277,51 +439,57 @@ class PreprocessorAPI(BaseAPI):
         (x1, y1) with the provided radius."""
 
         x, y = points[0]
-        top_point = (x, y + (radius / 1))
-        bottom_point = (x, y - (radius / 1))
-        self.draw_arc(points=[top_point, bottom_point], angle=180, max_seg=max_seg, group=group)
-        self.draw_arc(points=[bottom_point, top_point], angle=180, max_seg=max_seg, group=group)
+        top_point = (x, y + radius)
+        bottom_point = (x, y - radius)
+        with self.session.batch():
+            # Both arcs share the same two nodes so only add them once.
+            self.add_node(points=[top_point], group=group)
+            self.add_node(points=[bottom_point], group=group)
+            self.add_arc(points=[top_point, bottom_point], angle=180, max_seg=max_seg, group=group)
+            self.add_arc(points=[bottom_point, top_point], angle=180, max_seg=max_seg, group=group)
 
     def draw_annulus(self, points=None, inner_radius=None, outer_radius=None, max_seg=None, group=None):
         """Creates two concentric circles with the outer and inner radii provided.
         The same ``max_seg`` value is used for both circles."""
 
-        self.draw_circle(points=points, radius=inner_radius, max_seg=max_seg, group=group)
-        self.draw_circle(points=points, radius=outer_radius, max_seg=max_seg, group=group)
+        with self.session.batch():
+            self.draw_circle(points=points, radius=inner_radius, max_seg=max_seg, group=group)
+            self.draw_circle(points=points, radius=outer_radius, max_seg=max_seg, group=group)
 
     def draw_rectangle(self, points=None, group=None):
         """Adds nodes at the corners of a rectangle defined by the points (x1, y1) and
         (x2, y2), then adds segments connecting the corners of the rectangle."""
 
-        self.draw_line(points=points, group=group)
-        self.draw_line(points=points, group=group)
-        self.draw_line(points=points, group=group)
-        self.draw_line(points=points, group=group)
+        (x1, y1), (x2, y2) = points
+        with self.session.batch():
+            self.draw_polygon(points=[[x1, y1], [x2, y1], [x2, y2], [x1, y2]], group=group)
 
     def delete_selected(self):
         """Delete all selected objects."""
 
-        self._call_femm('deleteselected')
+        self._call_femm_void('deleteselected')
+        self.clear_nodes()
 
     def delete_selected_nodes(self):
         """Delete selected nodes."""
 
-        self._call_femm('deleteselectednodes')
+        self._call_femm_void('deleteselectednodes')
+        self.clear_nodes()
 
     def delete_selected_labels(self):
         """Delete selected labels."""
 
-        self._call_femm('deleteselectedlabels', add_doctype_prefix=True)
+        self._call_femm_void('deleteselectedlabels', add_doctype_prefix=True)
 
     def delete_selected_segments(self):
         """Delete selected segments."""
 
-        self._call_femm('deleteselectedsegments')
+        self._call_femm_void('deleteselectedsegments')
 
     def delete_selected_arc_segments(self):
         """Delete selected arc segments."""
 
-        self._call_femm('deleteselectedarcsegments')
+        self._call_femm_void('deleteselectedarcsegments')
 
     # Geometry Selection Commands
 
@@ -480,23 +648,26 @@ class PreprocessorAPI(BaseAPI):
     def zoom_natural(self):
         """Zooms to a “natural” view with sensible extents."""
 
-        self._call_femm('zoomnatural', add_doctype_prefix=True)
+        self._call_femm_void('zoomnatural', add_doctype_prefix=True)
 
     def zoom_out(self):
         """Zoom out by a factor of 50%."""
 
-        self._call_femm('zoomout', add_doctype_prefix=True)
+        self._call_femm_void('zoomout', add_doctype_prefix=True)
 
     def zoom_in(self):
         """Zoom in by a factor of 200%."""
 
-        self._call_femm('zoomin', add_doctype_prefix=True)
+        self._call_femm_void('zoomin', add_doctype_prefix=True)
 
     def zoom(self, x1, y1, x2, y2):
         """Set the display area to be from the bottom left corner specified by
         (x1, y1) to the top right corner specified by (x2, y2)."""
 
-        self._call_femm_with_args('zoom', x1, y1, x2, y2)
+        if all(type(value) in NUMERIC_TYPES for value in (x1, y1, x2, y2)):
+            self._call_void(f'{self.session.doctype_prefix}i_zoom({x1}, {y1}, {x2}, {y2})')
+        else:
+            self._call_femm_with_args('zoom', x1, y1, x2, y2)
 
     # View Commands
 